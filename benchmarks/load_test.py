@@ -0,0 +1,495 @@
+"""Drive the gallery app's routes under a realistic mix and report per-route
+latency, throughput, memory and DB/S3 calls per request.
+
+    python benchmarks/load_test.py --users 1000 --photos 20000 --requests 5000
+    python benchmarks/load_test.py --mix gallery=60,search=40 --no-response-cache
+    python benchmarks/load_test.py --mongo-uri mongodb://localhost:27017 --s3-endpoint http://localhost:5000
+
+mongomock and moto come from requirements-dev.txt.
+
+The app is built with create_app() against mongomock (or a local mongod)
+and moto's in-process S3 (or a moto server), seeded with synthetic users and
+photos, and exercised through Flask's test client from --concurrency
+threads. Results are printed as JSON so runs can be diffed.
+
+DB and S3 calls come from each request's metrics trace. mongomock does not
+publish pymongo command events, so against mongomock the collections are
+wrapped to record one call per driver method instead; a find() counts once
+however many batches it would have fetched. A synchronous upload_file
+counts as one S3 call on its request; the PutObject/UploadPart requests it
+makes run on s3transfer's threads and, like thumbnail jobs and batch
+uploads, are reported separately under background_calls. mongomock also scans in
+Python, so point --mongo-uri at a real mongod for representative DB times.
+
+peak_rss_mb per route is the largest resident set seen right after one of
+that route's requests. With --concurrency above 1 other requests are in
+flight too, so use --concurrency 1 to attribute memory to a route.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+import traceback
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson.objectid import ObjectId  # noqa: E402
+from PIL import Image  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import metrics  # noqa: E402
+from search_benchmark import WORDS, QUERIES  # noqa: E402
+
+DEFAULT_MIX = 'gallery=45,search=20,login=5,upload=5,download=20,delete=5'
+BUCKET = 'load-test-photos'
+PASSWORD = 'load-test-password'
+
+# Driver methods that cost a round trip (or more) on a real server
+MONGO_METHODS = {
+    'find', 'find_one', 'find_one_and_update', 'find_one_and_replace', 'find_one_and_delete',
+    'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'delete_one',
+    'delete_many', 'count_documents', 'aggregate', 'distinct', 'bulk_write', 'create_index',
+}
+
+
+class CountingCollection:
+    """Records each driver call on the current request's metrics trace.
+
+    mongomock also edits projection dicts in place, which races when
+    threads share one such as PHOTO_FIELDS, so top-level dict arguments
+    are copied first.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in MONGO_METHODS:
+            return attribute
+
+        def call(*args, **kwargs):
+            args = [dict(arg) if isinstance(arg, dict) else arg for arg in args]
+            kwargs = {key: dict(value) if isinstance(value, dict) else value for key, value in kwargs.items()}
+            start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                metrics.record('mongo', name, time.perf_counter() - start)
+        return call
+
+
+class CountingDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name):
+        return CountingCollection(self._database[name])
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name])
+
+    def command(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._database.command(*args, **kwargs)
+        finally:
+            metrics.record('mongo', 'command', time.perf_counter() - start)
+
+
+class BackgroundCalls:
+    """Counts the DB/S3 operations recorded outside any request."""
+
+    def __init__(self):
+        self.counts = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def install(self):
+        record = metrics.record
+
+        def counting_record(kind, name, seconds):
+            if metrics.current_trace() is None:
+                with self._lock:
+                    self.counts[kind][name] += 1
+            record(kind, name, seconds)
+        metrics.record = counting_record
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {kind: dict(sorted(names.items())) for kind, names in sorted(self.counts.items())}
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'unknown route {name!r}; choose from {", ".join(OPERATIONS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def jpeg(rng, size):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3))).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class Corpus:
+    """Photos the workload can download or delete, shared by all threads."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.photos = []
+        self._lock = threading.Lock()
+
+    def add(self, photo_id, key, filename):
+        with self._lock:
+            self.photos.append((photo_id, key, filename))
+
+    def pick(self):
+        with self._lock:
+            return self.rng.choice(self.photos) if self.photos else None
+
+    def take(self):
+        with self._lock:
+            if not self.photos:
+                return None
+            index = self.rng.randrange(len(self.photos))
+            self.photos[index], self.photos[-1] = self.photos[-1], self.photos[index]
+            return self.photos.pop()
+
+
+def seed(gallery, args, rng, corpus):
+    """Insert users and photos directly, and args.objects distinct images
+    shared between the photos the way deduplicated uploads would be."""
+    db = gallery.clients.db()
+    password_hash = generate_password_hash(PASSWORD, gallery.password_hasher.method)
+    usernames = [f'user{i}' for i in range(args.users)]
+    users = [{'_id': f'load-test-user-{i}', 'username': name, 'password_hash': password_hash}
+             for i, name in enumerate(usernames)]
+    for start in range(0, len(users), 10000):
+        db.users.insert_many(users[start:start + 10000])
+
+    s3 = gallery.clients.s3()
+    objects = []
+    for _ in range(args.objects):
+        body = jpeg(rng, tuple(args.image_size))
+        digest = hashlib.sha256(body).hexdigest()
+        key = gallery.content_store.key_for(digest, 'jpg')
+        s3.put_object(Bucket=BUCKET, Key=key, Body=body, ContentType='image/jpeg')
+        objects.append({'_id': digest, 'key': key, 'size': len(body), 'content_type': 'image/jpeg',
+                        'refcount': 0})
+
+    photos = []
+    for i in range(args.photos):
+        stored = objects[i % len(objects)]
+        stored['refcount'] += 1
+        filename = f'{rng.choice(WORDS)}_{i}.jpg'
+        photos.append({
+            '_id': ObjectId(),
+            'filename': filename,
+            'key': stored['key'],
+            'sha256': stored['_id'],
+            'description': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 6))),
+            'user_id': rng.choice(users)['_id'],
+        })
+        corpus.add(str(photos[-1]['_id']), stored['key'], filename)
+    for start in range(0, len(photos), 10000):
+        db.imageReferences.insert_many(photos[start:start + 10000])
+    if objects:
+        db.storedObjects.insert_many(objects)
+    return usernames
+
+
+def sign_in(client, context):
+    username = context['rng'].choice(context['usernames'])
+    return client.post('/login', data={'username': username, 'password': PASSWORD}), (302,)
+
+
+def login(client, context):
+    # A new visitor; the worker's own client is already signed in
+    return sign_in(context['app'].test_client(), context)
+
+
+def gallery_page(client, context):
+    # Half the views scroll past the first page
+    photo = context['corpus'].pick() if context['rng'].random() < 0.5 else None
+    query = {'after': photo[0]} if photo else {}
+    return client.get('/', query_string=query), (200, 304)
+
+
+def search(client, context):
+    return client.get('/', query_string={'search': context['rng'].choice(QUERIES)}), (200, 304)
+
+
+def upload(client, context):
+    body = jpeg(context['rng'], tuple(context['args'].image_size))
+    filename = f"{context['rng'].choice(WORDS)}.jpg"
+    data = {'file': (io.BytesIO(body), filename),
+            'description': ' '.join(context['rng'].choice(WORDS) for _ in range(3))}
+    return client.post('/upload', data=data, content_type='multipart/form-data'), (302,)
+
+
+def download(client, context):
+    photo = context['corpus'].pick()
+    if photo is None:
+        return None, ()
+    response = client.get(f'/download/{photo[1]}', query_string={'name': photo[2]})
+    response.get_data()
+    response.close()
+    return response, (200, 206, 302)
+
+
+def delete(client, context):
+    photo = context['corpus'].take()
+    if photo is None:
+        return None, ()
+    return client.post(f'/delete/{photo[0]}'), (302,)
+
+
+OPERATIONS = {
+    'gallery': gallery_page,
+    'search': search,
+    'login': login,
+    'upload': upload,
+    'download': download,
+    'delete': delete,
+}
+
+
+class Results:
+    def __init__(self):
+        self.samples = defaultdict(list)   # route -> [(ms, mongo calls, s3 calls, rss mb)]
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, route, ms, counts, rss):
+        with self._lock:
+            self.samples[route].append((ms, counts.get('mongo', 0), counts.get('s3', 0), rss))
+
+    def error(self, route):
+        with self._lock:
+            self.errors[route] += 1
+
+    def summary(self, elapsed):
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            latencies = sorted(sample[0] for sample in samples)
+            routes[route] = {
+                'requests': len(samples),
+                'errors': self.errors.get(route, 0),
+                'throughput_rps': round(len(samples) / elapsed, 2),
+                'p50_ms': round(percentile(latencies, 0.50), 3),
+                'p95_ms': round(percentile(latencies, 0.95), 3),
+                'p99_ms': round(percentile(latencies, 0.99), 3),
+                'mean_ms': round(statistics.fmean(latencies), 3),
+                'max_ms': round(latencies[-1], 3),
+                'db_calls': count_summary(sample[1] for sample in samples),
+                's3_calls': count_summary(sample[2] for sample in samples),
+                'peak_rss_mb': round(max(sample[3] for sample in samples), 1),
+            }
+        for route, count in self.errors.items():
+            routes.setdefault(route, {'requests': 0, 'errors': count})
+        return routes
+
+
+def count_summary(counts):
+    counts = sorted(counts)
+    return {'mean': round(statistics.fmean(counts), 2), 'p95': percentile(counts, 0.95), 'max': counts[-1]}
+
+
+def worker(app, context, plan, results, record):
+    client = app.test_client()
+    sign_in(client, context)
+    previous = metrics.last_request()
+    for route in plan:
+        start = time.perf_counter()
+        try:
+            response, expected = OPERATIONS[route](client, context)
+        except Exception:
+            traceback.print_exc()
+            results.error(route)
+            continue
+        ms = (time.perf_counter() - start) * 1000
+        if response is None:
+            continue
+        trace = metrics.last_request()
+        counts = trace.counts() if trace is not None and trace is not previous else {}
+        previous = trace
+        if response.status_code not in expected:
+            results.error(route)
+        elif record:
+            results.add(route, ms, counts, current_rss_mb())
+        if route == 'upload' and response.status_code == 302:
+            # New photos become candidates for download and delete
+            photo = context['db'].imageReferences.find_one(sort=[('_id', -1)])
+            context['corpus'].add(str(photo['_id']), photo['key'], photo['filename'])
+
+
+def drive(app, context, mix, count, concurrency, record, rng):
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    plan = rng.choices(routes, weights, k=count)
+    results = Results()
+    threads = [
+        threading.Thread(target=worker, args=(app, context, plan[i::concurrency], results, record))
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def run(args):
+    import app as gallery
+
+    overrides = {
+        'MONGO_URI': args.mongo_uri,
+        'MONGO_TLS': False,
+        'MONGO_DB_NAME': 'load_test',
+        'S3_BUCKET_NAME': BUCKET,
+        'S3_ENDPOINT_URL': args.s3_endpoint,
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'RESPONSE_CACHE_ENABLED': not args.no_response_cache,
+        'RESPONSE_CACHE_BACKEND': 'memory',
+        'SLOW_REQUEST_MS': 10 ** 9,
+    }
+    if args.hash_method:
+        overrides['PASSWORD_HASH_METHOD'] = args.hash_method
+    app = gallery.create_app(**overrides)
+
+    if args.mongo_uri.startswith('mongomock://'):
+        database = gallery.clients.db
+        gallery.clients.db = lambda: CountingDatabase(database())
+    else:
+        gallery.clients.mongo().drop_database('load_test')
+
+    s3 = gallery.clients.s3()
+    try:
+        s3.create_bucket(Bucket=BUCKET,
+                         CreateBucketConfiguration={'LocationConstraint': app.config['AWS_REGION_NAME']})
+    except s3.exceptions.BucketAlreadyOwnedByYou:
+        # A moto server keeps its objects between runs
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=BUCKET):
+            for item in page.get('Contents', []):
+                s3.delete_object(Bucket=BUCKET, Key=item['Key'])
+
+    rng = random.Random(args.seed)
+    corpus = Corpus(rng)
+    start = time.perf_counter()
+    usernames = seed(gallery, args, rng, corpus)
+    seed_seconds = time.perf_counter() - start
+    gallery.warm_up(app)
+
+    context = {'app': app, 'args': args, 'rng': rng, 'usernames': usernames, 'corpus': corpus,
+               'db': gallery.clients.mongo()[app.config['MONGO_DB_NAME']]}
+    background = BackgroundCalls()
+    background.install()
+    if args.warmup:
+        drive(app, context, args.mix, args.warmup, args.concurrency, False, rng)
+    gallery.thumbnails.shutdown(wait=True)
+    background.reset()
+    results, elapsed = drive(app, context, args.mix, args.requests, args.concurrency, True, rng)
+
+    gallery.thumbnails.shutdown(wait=True)
+    gallery.password_hasher.shutdown()
+    measured = sum(len(samples) for samples in results.samples.values())
+    return {
+        'config': {
+            'users': args.users,
+            'photos': args.photos,
+            'objects': args.objects,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'mix': args.mix,
+            'response_cache': not args.no_response_cache,
+            'mongo': 'mongomock' if args.mongo_uri.startswith('mongomock://') else args.mongo_uri,
+            's3': args.s3_endpoint or 'moto',
+            'seed': args.seed,
+        },
+        'seed_seconds': round(seed_seconds, 2),
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(measured / elapsed, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'routes': results.summary(elapsed),
+        'background_calls': background.snapshot(),
+        'thumbnails': gallery.thumbnails.stats.snapshot(),
+        'response_cache': {'hits': gallery.response_cache.hits, 'misses': gallery.response_cache.misses},
+        'username_cache': {'hits': gallery.username_cache.hits, 'misses': gallery.username_cache.misses},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--photos', type=int, default=10000)
+    parser.add_argument('--objects', type=int, default=200,
+                        help='distinct images stored in S3; photos share them round-robin')
+    parser.add_argument('--image-size', type=int, nargs=2, default=[640, 480], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100, help='unmeasured requests run first')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help=f'route weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--no-response-cache', action='store_true',
+                        help='render every gallery/search page instead of serving cached ones')
+    parser.add_argument('--hash-method', help='override PASSWORD_HASH_METHOD, e.g. a cheaper scrypt')
+    parser.add_argument('--mongo-uri', default='mongomock://', help='local mongod instead of mongomock')
+    parser.add_argument('--s3-endpoint', help='moto server URL instead of in-process moto')
+    parser.add_argument('--seed', type=int, default=422)
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    if args.s3_endpoint:
+        report = run(args)
+    else:
+        from moto import mock_aws
+        with mock_aws():
+            report = run(args)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Compare gallery search latency: the old unanchored $regex scan versus the
+in-process SearchIndex.
+
+    python benchmarks/search_benchmark.py --sizes 10000 100000 1000000
+    python benchmarks/search_benchmark.py --mongo-uri mongodb://localhost:27017
+
+Both paths do the work the gallery route does for a page of results: the
+regex path runs the query, the index path searches and then fetches the
+page's photos with an _id $in query, and both then look up the uploaders'
+usernames in one batched query.
+
+Without --mongo-uri both paths run against mongomock, which answers every
+query, the _id $in fetch included, by scanning the collection in Python;
+point it at a real mongod for numbers that reflect server-side index use.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson.objectid import ObjectId  # noqa: E402
+
+from search_index import SearchIndex  # noqa: E402
+
+WORDS = (
+    'blastoise charizard pikachu heatran window plains grassy train eel incense cat dog meme '
+    'sunset beach mountain river city night skyline forest snow desert bridge portrait diagram '
+    'hash table assignment roomba screenshot yin yang minesweeper skeptical cries cool'
+).split()
+
+QUERIES = ['cat', 'char', 'grassy plains', 'sky', 'hash table', 'zzz', 'b']
+
+USERS = 50
+
+# The fields the gallery renders
+PHOTO_FIELDS = {'filename': 1, 'key': 1, 'description': 1, 'user_id': 1, 'derivatives': 1}
+
+
+def synthetic_photos(count, seed=422):
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            '_id': ObjectId(),
+            'filename': f'{rng.choice(WORDS)}_{i}.jpg',
+            'description': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 6))),
+            'user_id': str(rng.randint(1, USERS)),
+        }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'max_ms': round(samples[-1], 3),
+    }
+
+
+def open_database(mongo_uri):
+    if mongo_uri:
+        from pymongo import MongoClient
+        database = MongoClient(mongo_uri)['search_benchmark']
+    else:
+        import mongomock
+        database = mongomock.MongoClient()['search_benchmark']
+    database.imageReferences.drop()
+    database.users.drop()
+    return database
+
+
+def attach_usernames(users, photos):
+    # One batched lookup per page, as the gallery's username cache does on a miss
+    user_ids = list({photo['user_id'] for photo in photos})
+    usernames = {user['_id']: user['username'] for user in users.find({'_id': {'$in': user_ids}}, {'username': 1})}
+    for photo in photos:
+        photo['username'] = usernames.get(photo['user_id'])
+    return photos
+
+
+def regex_page(database, query, page_size):
+    photos = list(database.imageReferences.find(
+        {'description': {'$regex': query, '$options': 'i'}}, PHOTO_FIELDS).limit(page_size))
+    return attach_usernames(database.users, photos)
+
+
+def index_page(database, index, query, page_size):
+    page_ids = index.search(query)[:page_size]
+    found = {photo['_id']: photo
+             for photo in database.imageReferences.find({'_id': {'$in': page_ids}}, PHOTO_FIELDS)}
+    photos = [found[photo_id] for photo_id in page_ids if photo_id in found]
+    return attach_usernames(database.users, photos)
+
+
+def run(size, args):
+    database = open_database(args.mongo_uri)
+    collection = database.imageReferences
+    database.users.insert_many({'_id': str(i), 'username': f'user{i}'} for i in range(1, USERS + 1))
+    docs = list(synthetic_photos(size))
+    for start in range(0, size, 10000):
+        collection.insert_many(docs[start:start + 10000])
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.rebuild((doc['_id'], doc['description'], doc['filename'], 'user' + doc['user_id']) for doc in docs)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    result = {'documents': size, 'index_build_ms': round(build_ms, 1), 'queries': {}}
+    for query in QUERIES:
+        regex = timed(lambda: regex_page(database, query, args.page_size), args.repeat)
+        indexed = timed(lambda: index_page(database, index, query, args.page_size), args.repeat)
+        result['queries'][query] = {'regex': summarize(regex), 'index': summarize(indexed)}
+
+    collection.drop()
+    database.users.drop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--page-size', type=int, default=24)
+    parser.add_argument('--mongo-uri', help='real MongoDB/DocumentDB to run the regex path against')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results.append(run(size, args))
+        print(json.dumps(results[-1], indent=2), file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
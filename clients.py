@@ -0,0 +1,170 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config as BotoConfig
+from pymongo import MongoClient, monitoring
+
+import metrics
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts open and checked-out connections across a MongoClient's pools."""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self._lock = threading.Lock()
+
+    def _add(self, field, delta):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def connection_created(self, event):
+        self._add('open', 1)
+
+    def connection_closed(self, event):
+        self._add('open', -1)
+
+    def connection_checked_out(self, event):
+        self._add('checked_out', 1)
+
+    def connection_checked_in(self, event):
+        self._add('checked_out', -1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+
+class Clients:
+    """Per-process MongoClient and S3 client, created on first use.
+
+    Nothing connects at import time, and pymongo clients are not fork-safe,
+    so a client created before a fork (gunicorn --preload) is dropped and
+    rebuilt in each worker the first time that worker needs it.
+
+    on_mongo_connect(db) runs once per process when the MongoClient is
+    created, before any other thread can use it; the app creates its
+    indexes there.
+    """
+
+    def __init__(self, on_mongo_connect=None):
+        self.config = None
+        self.on_mongo_connect = on_mongo_connect
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._mongo = None
+        self._s3 = None
+        self.pool_stats = PoolStats()
+        self.s3_in_flight = 0
+
+    def init_app(self, app):
+        self.config = app.config
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def mongo(self):
+        self._check_fork()
+        if self._mongo is None:
+            with self._lock:
+                if self._mongo is None:
+                    client = self._connect_mongo()
+                    if self.on_mongo_connect:
+                        self.on_mongo_connect(client[self.config['MONGO_DB_NAME']])
+                    self._mongo = client
+        return self._mongo
+
+    def db(self):
+        return self.mongo()[self.config['MONGO_DB_NAME']]
+
+    def s3(self):
+        self._check_fork()
+        if self._s3 is None:
+            with self._lock:
+                if self._s3 is None:
+                    self._s3 = self._connect_s3()
+        return self._s3
+
+    def _connect_mongo(self):
+        uri = self.config['MONGO_URI']
+        if uri.startswith('mongomock://'):
+            # In-memory stand-in for tests and benchmarks
+            import mongomock
+            return mongomock.MongoClient()
+
+        options = {
+            'maxPoolSize': self.config['MONGO_MAX_POOL_SIZE'],
+            'minPoolSize': self.config['MONGO_MIN_POOL_SIZE'],
+            'retryWrites': False,
+            'event_listeners': [metrics.MongoCommandListener(), self.pool_stats],
+        }
+        if self.config['MONGO_TLS']:
+            options.update(tls=True, tlsCAFile=self.config['MONGO_TLS_CA_FILE'])
+        return MongoClient(uri, **options)
+
+    def _connect_s3(self):
+        # A dedicated session: the boto3 default session is not thread-safe
+        session = boto3.session.Session(
+            aws_access_key_id=self.config['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=self.config['AWS_SECRET_ACCESS_KEY'],
+            region_name=self.config['AWS_REGION_NAME']
+        )
+        client = session.client(
+            's3',
+            endpoint_url=self.config['S3_ENDPOINT_URL'],
+            config=BotoConfig(max_pool_connections=self.config['S3_MAX_POOL_CONNECTIONS'])
+        )
+        metrics.instrument_boto(client)
+        client.meta.events.register('before-call.s3', self._s3_call_started)
+        client.meta.events.register('after-call.s3', self._s3_call_finished)
+        client.meta.events.register('after-call-error.s3', self._s3_call_finished)
+        return client
+
+    def _s3_call_started(self, **kwargs):
+        with self._lock:
+            self.s3_in_flight += 1
+
+    def _s3_call_finished(self, **kwargs):
+        with self._lock:
+            self.s3_in_flight -= 1
+
+    def stats(self):
+        self._check_fork()
+        return {
+            'pid': self._pid,
+            'mongo': {
+                'connected': self._mongo is not None,
+                'max_pool_size': self.config['MONGO_MAX_POOL_SIZE'],
+                'open_connections': self.pool_stats.open,
+                'checked_out': self.pool_stats.checked_out,
+            },
+            's3': {
+                'connected': self._s3 is not None,
+                'max_pool_connections': self.config['S3_MAX_POOL_CONNECTIONS'],
+                'in_flight': self.s3_in_flight,
+            },
+        }
@@ -4,7 +4,7 @@ from dotenv import load_dotenv
 class Config:
     load_dotenv()
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
-    SQLALCHEMY_DATABASE_URI = f"mysql+mysqlconnector://{os.environ['DB_USER']}:{os.environ['DB_PASSWORD']}@{os.environ['DB_HOST']}/{os.environ['DB_NAME']}"
+    SQLALCHEMY_DATABASE_URI = f"mysql+mysqlconnector://{os.environ.get('DB_USER')}:{os.environ.get('DB_PASSWORD')}@{os.environ.get('DB_HOST')}/{os.environ.get('DB_NAME')}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = 'static/uploads'
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
@@ -18,4 +18,72 @@ class Config:
      # DynamoDB Table Names
     DYNAMODB_USERS_TABLE = os.environ.get('DYNAMODB_USERS_TABLE', 'UsersTable')
     DYNAMODB_PHOTOS_TABLE = os.environ.get('DYNAMODB_PHOTOS_TABLE', 'PhotosTable')
-    MONGO_DB_NAME = os.environ.get('MONGO_DB_NAME')
\ No newline at end of file
+    MONGO_DB_NAME = os.environ.get('MONGO_DB_NAME')
+
+    # Connection pools, one set per worker process. MONGO_URI is required
+    # (set it in .env); 'mongomock://' and an S3 endpoint such as a local
+    # moto server boot the app without AWS.
+    MONGO_URI = os.environ.get('MONGO_URI')
+    MONGO_TLS = os.environ.get('MONGO_TLS', '1') == '1'
+    MONGO_TLS_CA_FILE = os.environ.get('MONGO_TLS_CA_FILE', 'global-bundle.pem')
+    MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+    MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 50))
+
+    # Rebuild the search index while a worker warms up rather than on its first search
+    WARM_UP_SEARCH_INDEX = os.environ.get('WARM_UP_SEARCH_INDEX', '0') == '1'
+
+    # Process-wide _id -> username cache
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+
+    # Gallery pagination
+    GALLERY_PAGE_SIZE = int(os.environ.get('GALLERY_PAGE_SIZE', 24))
+    GALLERY_MAX_PAGE_SIZE = int(os.environ.get('GALLERY_MAX_PAGE_SIZE', 100))
+
+    # Seconds between full rebuilds of the in-process search index
+    SEARCH_INDEX_REFRESH = int(os.environ.get('SEARCH_INDEX_REFRESH', 300))
+
+    # Downloads: 'stream' passes S3 bytes through in chunks, 'redirect' sends
+    # the client to a presigned URL
+    DOWNLOAD_MODE = os.environ.get('DOWNLOAD_MODE', 'stream')
+    DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 64 * 1024))
+    DOWNLOAD_URL_EXPIRY = int(os.environ.get('DOWNLOAD_URL_EXPIRY', 3600))
+
+    # Thumbnail derivatives generated in the background after upload
+    THUMBNAIL_WIDTHS = tuple(int(width) for width in os.environ.get('THUMBNAIL_WIDTHS', '320,640,1024').split(','))
+    THUMBNAIL_PREFIX = os.environ.get('THUMBNAIL_PREFIX', 'derivatives/')
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+    THUMBNAIL_QUEUE_SIZE = int(os.environ.get('THUMBNAIL_QUEUE_SIZE', 100))
+
+    # Background batch uploads
+    UPLOAD_PART_SIZE = int(os.environ.get('UPLOAD_PART_SIZE', 8 * 1024 * 1024))
+    UPLOAD_MAX_CONCURRENCY = int(os.environ.get('UPLOAD_MAX_CONCURRENCY', 10))
+    UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR')
+    # A batch with no heartbeat for this many seconds is reported failed
+    UPLOAD_BATCH_STALE_AFTER = int(os.environ.get('UPLOAD_BATCH_STALE_AFTER', 300))
+
+    # S3 prefix for content-addressed (SHA-256 keyed) photo objects
+    CONTENT_PREFIX = os.environ.get('CONTENT_PREFIX', 'objects/')
+
+    # Password hashing runs in a separate process pool. Changing the method
+    # rehashes existing passwords on their next successful login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 32))
+    PASSWORD_HASH_TIMEOUT = int(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+
+    # Requests slower than this are logged with their slowest DB/S3 calls
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 1000))
+
+    # Gallery/search response cache. 'memory' keeps entries per worker and
+    # the collection version in MongoDB; 'redis' shares both across workers.
+    # Entries expire after RESPONSE_CACHE_TTL seconds either way.
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', '1') == '1'
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+    RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    RESPONSE_CACHE_REDIS_URL = os.environ.get('RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    # How long a worker reuses the shared version before reading it again
+    RESPONSE_CACHE_VERSION_TTL = float(os.environ.get('RESPONSE_CACHE_VERSION_TTL', 1))
@@ -0,0 +1,27 @@
+# gunicorn -c gunicorn.conf.py 'app:create_app()'
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_class = 'gthread'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+
+# Import the app once in the master and fork it. Nothing connects at import
+# time; each worker opens its own MongoDB/S3 pools in post_fork below.
+preload_app = True
+
+
+def post_fork(server, worker):
+    from app import warm_up
+
+    # With preload_app the master already built the app; this returns it
+    warm_up(server.app.wsgi())
+
+
+def worker_exit(server, worker):
+    from app import shutdown
+
+    # Batches still transferring are recorded rather than left for the
+    # stale-batch sweep; graceful_timeout bounds the wait
+    shutdown()
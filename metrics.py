@@ -0,0 +1,254 @@
+"""Lightweight request instrumentation.
+
+Every request gets a RequestTrace in a thread-local. pymongo command
+events, botocore call hooks and Jinja render signals add their timings to
+it, and at the end of the request the totals go into per-route histograms,
+a Server-Timing header and, for slow requests, a log line listing the
+operations that took the time. Work done outside a request (background
+uploads, thumbnail jobs) is counted under the '<background>' route.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import request, template_rendered, before_render_template
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+BACKGROUND = '<background>'
+
+# Server-Timing metric names for each operation kind
+TIMING_NAMES = {'mongo': 'db', 's3': 's3', 'render': 'render'}
+
+# Only this many individual operations are kept per request for the slow log
+MAX_TRACED_OPS = 200
+
+_local = threading.local()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Registry:
+    def __init__(self):
+        self._histograms = {}
+        self._help = {}
+        self._collected = []
+        self._lock = threading.Lock()
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS, help_text=''):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+                self._help.setdefault(name, help_text)
+            histogram.observe(value)
+
+    def register_gauge(self, name, help_text, collect):
+        """collect() returns a number, or a {((label, value), ...): number} mapping."""
+        self._collected.append((name, 'gauge', help_text, collect))
+
+    def register_counter(self, name, help_text, collect):
+        """Like register_gauge, for values that only ever go up; name
+        should end in _total."""
+        self._collected.append((name, 'counter', help_text, collect))
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            by_name = defaultdict(list)
+            for (name, labels), histogram in self._histograms.items():
+                by_name[name].append((labels, histogram))
+            for name in sorted(by_name):
+                lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in by_name[name]:
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+                    lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {histogram.count}')
+                    lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+
+        for name, kind, help_text, collect in self._collected:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            values = collect()
+            if not isinstance(values, dict):
+                values = {(): values}
+            for labels, value in values.items():
+                lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+registry = Registry()
+
+
+class RequestTrace:
+    def __init__(self, route):
+        self.route = route
+        self.start = time.perf_counter()
+        self.duration = None
+        self.totals = defaultdict(lambda: [0, 0.0])   # kind -> [count, seconds]
+        self.ops = []
+
+    def record(self, kind, name, seconds):
+        total = self.totals[kind]
+        total[0] += 1
+        total[1] += seconds
+        if len(self.ops) < MAX_TRACED_OPS:
+            self.ops.append((kind, name, seconds))
+
+    def counts(self):
+        return {kind: total[0] for kind, total in self.totals.items()}
+
+    def server_timing(self):
+        parts = []
+        for kind in ('mongo', 's3', 'render'):
+            if kind in self.totals:
+                count, seconds = self.totals[kind]
+                parts.append(f'{TIMING_NAMES[kind]};dur={seconds * 1000:.1f};desc="{kind} x{count}"')
+        parts.append(f'total;dur={self.duration * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+def last_request():
+    """The trace of the most recent request finished on this thread."""
+    return getattr(_local, 'last', None)
+
+
+def record(kind, name, seconds):
+    trace = current_trace()
+    route = trace.route if trace else BACKGROUND
+    if trace:
+        trace.record(kind, name, seconds)
+    registry.observe(f'app_{kind}_operation_seconds', {'route': route, 'operation': name}, seconds,
+                     help_text=f'Latency of {kind} operations by route')
+
+
+@contextmanager
+def timed(kind, name):
+    """Record the enclosed block as one operation. For calls such as
+    s3transfer's upload_file, whose S3 requests run on its own threads and
+    so land under '<background>', this keeps the work on the request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, name, time.perf_counter() - start)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """pymongo publishes command events on the thread that issued them."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        record('mongo', event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        record('mongo', event.command_name, event.duration_micros / 1e6)
+
+
+def instrument_boto(client):
+    def before_call(model, context, **kwargs):
+        context['metrics_call'] = (model.name, time.perf_counter())
+
+    # after-call-error is emitted without the operation model
+    def after_call(context, **kwargs):
+        call = context.pop('metrics_call', None)
+        if call is not None:
+            record('s3', call[0], time.perf_counter() - call[1])
+
+    service = client.meta.service_model.service_name
+    client.meta.events.register(f'before-call.{service}', before_call)
+    client.meta.events.register(f'after-call.{service}', after_call)
+    client.meta.events.register(f'after-call-error.{service}', after_call)
+    return client
+
+
+def instrument_flask(app):
+    @app.before_request
+    def start_trace():
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        _local.trace = RequestTrace(route)
+
+    @app.after_request
+    def finish_trace(response):
+        trace = current_trace()
+        if trace is None:
+            return response
+        _local.trace = None
+        _local.last = trace
+        trace.duration = time.perf_counter() - trace.start
+
+        labels = {'route': trace.route, 'method': request.method}
+        registry.observe('app_request_duration_seconds', labels, trace.duration,
+                         help_text='Request latency by route')
+        for kind in ('mongo', 's3'):
+            registry.observe(f'app_request_{kind}_calls', labels, trace.totals[kind][0] if kind in trace.totals else 0,
+                             buckets=COUNT_BUCKETS, help_text=f'{kind} calls per request by route')
+        response.headers['Server-Timing'] = trace.server_timing()
+
+        if trace.duration * 1000 >= app.config['SLOW_REQUEST_MS']:
+            slowest = sorted(trace.ops, key=lambda op: op[2], reverse=True)[:10]
+            logger.warning('Slow request %s %s took %.1fms (%s); slowest operations: %s',
+                           request.method, request.path, trace.duration * 1000,
+                           ', '.join(f'{kind} x{count}' for kind, count in trace.counts().items()),
+                           ', '.join(f'{kind}.{name} {seconds * 1000:.1f}ms' for kind, name, seconds in slowest))
+        return response
+
+    @app.teardown_request
+    def drop_trace(exc):
+        # Requests that raised never reach after_request
+        _local.trace = None
+
+    def render_started(sender, template, context, **extra):
+        trace = current_trace()
+        if trace is not None:
+            trace.render_start = time.perf_counter()
+
+    def render_finished(sender, template, context, **extra):
+        trace = current_trace()
+        start = getattr(trace, 'render_start', None)
+        if start is not None:
+            record('render', template.name, time.perf_counter() - start)
+            trace.render_start = None
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
@@ -0,0 +1,397 @@
+"""Bulk-migrate users and photo references into DocumentDB/MongoDB or DynamoDB.
+
+Rows are streamed from a CSV export (users.csv, imageRef.csv) or straight
+from a table in the RDS MySQL database, written in batches by a pool of
+worker threads, and checkpointed so an interrupted run picks up where it
+stopped:
+
+    python migrate.py users users.csv --target mongo
+    python migrate.py photos imageRef.csv --target dynamodb --workers 8
+    python migrate.py photos table:images --target mongo --mongo-uri mongodb://localhost:27017 --mongo-db gallery
+
+Use --mongo-uri mongomock:// or --dynamodb-endpoint http://localhost:8000
+(DynamoDB Local) to try a migration without touching the real databases.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from config import Config
+
+logger = logging.getLogger('migrate')
+
+# DynamoDB rejects batch_write_item calls with more than 25 requests
+DYNAMODB_MAX_BATCH = 25
+
+DUPLICATE_KEY = 11000
+
+
+class MigrationError(Exception):
+    pass
+
+
+def normalize(kind, row):
+    """Map a source row (CSV export or MySQL table) to a common shape."""
+    if kind == 'users':
+        return {
+            'id': str(row.get('user_id') or row['id']),
+            'username': row['username'],
+            'password_hash': row['password_hash'],
+        }
+    return {
+        'id': str(row.get('image_id') or row['id']),
+        'filename': row['filename'],
+        'description': row.get('description') or '',
+        'user_id': str(row['user_id']),
+    }
+
+
+def iter_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        dialect = csv.Sniffer().sniff(sample, delimiters=',\t')
+        yield from csv.DictReader(f, dialect=dialect)
+
+
+def iter_table(table, chunk_size=1000):
+    import mysql.connector
+
+    if not re.fullmatch(r'\w+', table):
+        raise MigrationError(f'Invalid table name: {table}')
+    connection = mysql.connector.connect(
+        host=os.environ['DB_HOST'],
+        user=os.environ['DB_USER'],
+        password=os.environ['DB_PASSWORD'],
+        database=os.environ['DB_NAME']
+    )
+    try:
+        cursor = connection.cursor(dictionary=True)
+        # Ordered so a resumed run skips exactly the rows already written
+        cursor.execute(f'SELECT * FROM `{table}` ORDER BY 1')
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        connection.close()
+
+
+def backoff(attempt, base=0.05, cap=5.0):
+    # Exponential backoff with full jitter
+    time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+
+
+class MongoWriter:
+    """Upserts rows with one unordered bulk_write per batch.
+
+    With bulk=False each row is a separate replace_one instead. That is much
+    slower against a server but is the write path mongomock supports;
+    its bulk_write can't take the ReplaceOne operations current pymongo
+    builds.
+    """
+
+    def __init__(self, collection, kind, max_retries=8, bulk=True):
+        from pymongo import ReplaceOne
+        from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError
+
+        self.collection = collection
+        self.kind = kind
+        self.max_retries = max_retries
+        self.bulk = bulk
+        self._replace_one = ReplaceOne
+        self._transient = (AutoReconnect,)
+        self._bulk_write_error = BulkWriteError
+        self._duplicate_key_error = DuplicateKeyError
+        if kind == 'users':
+            collection.create_index('username', unique=True)
+        else:
+            # Photos keep their ObjectId _id; upserts key on the legacy id
+            collection.create_index('legacy_id', unique=True)
+
+    def _replacement(self, row):
+        """Returns the (filter, document) pair to upsert for row."""
+        if self.kind == 'users':
+            document = {'_id': row['id'], 'username': row['username'], 'password_hash': row['password_hash']}
+            return {'_id': row['id']}, document
+        document = {
+            'legacy_id': row['id'],
+            'filename': row['filename'],
+            'description': row['description'],
+            'user_id': row['user_id'],
+        }
+        return {'legacy_id': row['id']}, document
+
+    def write(self, rows):
+        """Write rows; returns the number rejected by a unique index."""
+        replacements = [self._replacement(row) for row in rows]
+        for attempt in range(self.max_retries + 1):
+            try:
+                if not self.bulk:
+                    return self._write_each(rows, replacements)
+                operations = [self._replace_one(query, document, upsert=True) for query, document in replacements]
+                self.collection.bulk_write(operations, ordered=False)
+                return 0
+            except self._bulk_write_error as e:
+                errors = e.details.get('writeErrors', [])
+                duplicates = [error for error in errors if error.get('code') == DUPLICATE_KEY]
+                if len(duplicates) == len(errors):
+                    for error in duplicates:
+                        logger.warning('Skipping row %s: %s', rows[error['index']]['id'], error.get('errmsg'))
+                    return len(duplicates)
+                if attempt == self.max_retries:
+                    raise
+            except self._transient:
+                if attempt == self.max_retries:
+                    raise
+            backoff(attempt)
+        return 0
+
+    def _write_each(self, rows, replacements):
+        # Every write is an upsert, so a retried batch may safely redo rows
+        rejected = 0
+        for row, (query, document) in zip(rows, replacements):
+            try:
+                self.collection.replace_one(query, document, upsert=True)
+            except self._duplicate_key_error as e:
+                logger.warning('Skipping row %s: %s', row['id'], e)
+                rejected += 1
+        return rejected
+
+
+class DynamoWriter:
+    def __init__(self, client, table, kind, max_retries=8):
+        from botocore.exceptions import ClientError
+
+        self.client = client
+        self.table = table
+        self.kind = kind
+        self.max_retries = max_retries
+        self._client_error = ClientError
+
+    def _item(self, row):
+        if self.kind == 'users':
+            return {
+                'user_id': {'S': row['id']},
+                'username': {'S': row['username']},
+                'password_hash': {'S': row['password_hash']},
+            }
+        return {
+            'image_id': {'S': row['id']},
+            'filename': {'S': row['filename']},
+            'description': {'S': row['description']},
+            'user_id': {'S': row['user_id']},
+        }
+
+    def write(self, rows):
+        # A batch may not contain the same key twice; the last row wins
+        unique = {row['id']: row for row in rows}
+        pending = [{'PutRequest': {'Item': self._item(row)}} for row in unique.values()]
+        for start in range(0, len(pending), DYNAMODB_MAX_BATCH):
+            self._write_chunk(pending[start:start + DYNAMODB_MAX_BATCH])
+        return 0
+
+    def _write_chunk(self, requests):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.client.batch_write_item(RequestItems={self.table: requests})
+                requests = response.get('UnprocessedItems', {}).get(self.table, [])
+            except self._client_error as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code not in ('ProvisionedThroughputExceededException', 'ThrottlingException',
+                                'RequestLimitExceeded', 'InternalServerError'):
+                    raise
+            if not requests:
+                return
+            if attempt < self.max_retries:
+                backoff(attempt)
+        raise MigrationError(f'{len(requests)} items still unprocessed after {self.max_retries} retries')
+
+
+class Checkpoint:
+    """Records how many leading source rows are safely written.
+
+    Batches finish out of order across workers, so the checkpoint only
+    advances over a contiguous run of completed batches. A resumed run may
+    rewrite a few rows past the checkpoint; every write is an upsert, so
+    that is harmless.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.rows_done = 0
+        self._finished = {}
+        self._next_start = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('source') == source:
+                self.rows_done = state['rows_done']
+        self._next_start = self.rows_done
+
+    def complete(self, start, end):
+        with self._lock:
+            self._finished[start] = end
+            advanced = False
+            while self._next_start in self._finished:
+                self._next_start = self._finished.pop(self._next_start)
+                advanced = True
+            if advanced:
+                self.rows_done = self._next_start
+                self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'source': self.source, 'rows_done': self.rows_done}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def migrate(rows, writer, checkpoint, batch_size=25, workers=4):
+    """Stream rows into writer in batches across worker threads.
+
+    Returns a dict of counts and timings. Rows before checkpoint.rows_done
+    are skipped.
+    """
+    start_time = time.perf_counter()
+    skip = checkpoint.rows_done
+    stats = {'resumed_from': skip, 'written': 0, 'rejected': 0}
+    stats_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    failures = []
+
+    def run(batch, start):
+        try:
+            rejected = writer.write(batch)
+            checkpoint.complete(start, start + len(batch))
+            with stats_lock:
+                stats['written'] += len(batch) - rejected
+                stats['rejected'] += rejected
+        except Exception as e:
+            logger.exception('Batch starting at row %d failed', start)
+            failures.append(e)
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batch = []
+        batch_start = skip
+        for position, row in enumerate(rows):
+            if position < skip:
+                continue
+            if failures:
+                break
+            batch.append(row)
+            if len(batch) == batch_size:
+                in_flight.acquire()
+                executor.submit(run, batch, batch_start)
+                batch_start += len(batch)
+                batch = []
+        if batch and not failures:
+            in_flight.acquire()
+            executor.submit(run, batch, batch_start)
+
+    stats['seconds'] = time.perf_counter() - start_time
+    stats['rows_per_second'] = stats['written'] / stats['seconds'] if stats['seconds'] else 0.0
+    if failures:
+        raise MigrationError(f'{len(failures)} batch(es) failed; rerun to resume from row {checkpoint.rows_done}')
+    checkpoint.clear()
+    return stats
+
+
+def open_mongo_collection(uri, database, kind):
+    if uri.startswith('mongomock://'):
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(uri, retryWrites=False)
+    collection = 'users' if kind == 'users' else 'imageReferences'
+    return client[database][collection]
+
+
+def open_dynamodb(endpoint):
+    import boto3
+
+    return boto3.client(
+        'dynamodb',
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+        region_name=os.environ.get('AWS_REGION_NAME', 'us-east-2'),
+        endpoint_url=endpoint
+    )
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('kind', choices=['users', 'photos'])
+    parser.add_argument('source', help='CSV export path, or table:<name> to read from the RDS MySQL database')
+    parser.add_argument('--target', choices=['mongo', 'dynamodb'], default='mongo')
+    parser.add_argument('--mongo-uri', default=Config.MONGO_URI)
+    parser.add_argument('--mongo-db', default=Config.MONGO_DB_NAME)
+    parser.add_argument('--table', help='DynamoDB table (defaults to the app\'s DYNAMODB_USERS_TABLE/DYNAMODB_PHOTOS_TABLE)')
+    parser.add_argument('--dynamodb-endpoint', help='e.g. http://localhost:8000 for DynamoDB Local')
+    parser.add_argument('--batch-size', type=int, help='rows per batch (default 25 for DynamoDB, 500 for Mongo)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--max-retries', type=int, default=8)
+    parser.add_argument('--checkpoint', help='checkpoint file (default .migrate-<kind>-<target>.json)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.target == 'mongo':
+        if not args.mongo_uri:
+            parser.error('--mongo-uri (or MONGO_URI) is required for --target mongo')
+        if not args.mongo_db:
+            parser.error('--mongo-db (or MONGO_DB_NAME) is required for --target mongo')
+        collection = open_mongo_collection(args.mongo_uri, args.mongo_db, args.kind)
+        writer = MongoWriter(collection, args.kind, args.max_retries,
+                             bulk=not args.mongo_uri.startswith('mongomock://'))
+        batch_size = args.batch_size or 500
+    else:
+        # Same tables the app reads from
+        table = args.table or (Config.DYNAMODB_USERS_TABLE if args.kind == 'users' else Config.DYNAMODB_PHOTOS_TABLE)
+        writer = DynamoWriter(open_dynamodb(args.dynamodb_endpoint), table, args.kind, args.max_retries)
+        batch_size = args.batch_size or DYNAMODB_MAX_BATCH
+
+    if args.source.startswith('table:'):
+        raw_rows = iter_table(args.source[len('table:'):])
+    else:
+        raw_rows = iter_csv(args.source)
+    rows = (normalize(args.kind, row) for row in raw_rows)
+
+    checkpoint = Checkpoint(args.checkpoint or f'.migrate-{args.kind}-{args.target}.json', args.source)
+    if checkpoint.rows_done:
+        logger.info('Resuming after row %d', checkpoint.rows_done)
+    try:
+        stats = migrate(rows, writer, checkpoint, batch_size=batch_size, workers=args.workers)
+    except MigrationError as e:
+        logger.error('%s', e)
+        return 1
+
+    logger.info('Wrote %d rows (%d rejected) in %.2fs: %.1f rows/s',
+                stats['written'], stats['rejected'], stats['seconds'], stats['rows_per_second'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
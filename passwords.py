@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PoolSaturated(Exception):
+    """Raised when the password pool already has max_pending calls queued."""
+
+
+class PoolTimeout(PoolSaturated):
+    """Raised when a call queued on the password pool doesn't finish within timeout."""
+
+
+class PasswordHasher:
+    """Runs password hashing and verification in a dedicated process pool.
+
+    scrypt holds the GIL for tens of milliseconds per call, so doing it in
+    the request thread stalls every other request in the worker. Calls
+    beyond max_pending fail fast with PoolSaturated instead of queueing
+    without bound.
+    """
+
+    def __init__(self, method='scrypt:32768:8:1', max_workers=2, max_pending=32, timeout=10):
+        self.method = method
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._method_prefix = None
+
+    def _pool(self):
+        with self._lock:
+            # A pool inherited across fork belongs to the parent
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                # forkserver children don't inherit the parent's threads,
+                # sockets or locks
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['werkzeug.security'])
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self._executor
+
+    def _discard(self, executor):
+        # A pool whose child died (OOM kill, segfault) rejects every later
+        # call, so drop it and let _pool() start a fresh one
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _call(self, fn, *args, retry=True):
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated()
+        executor = self._pool()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            future = None
+        except Exception:
+            self._slots.release()
+            raise
+        if future is not None:
+            future.add_done_callback(lambda _: self._slots.release())
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                raise PoolTimeout() from None
+            except BrokenProcessPool:
+                pass
+        self._discard(executor)
+        if retry:
+            return self._call(fn, *args, retry=False)
+        raise PoolSaturated()
+
+    def hash(self, password):
+        return self._call(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._call(check_password_hash, password_hash, password)
+
+    def warm_up(self):
+        """Start the pool's processes now rather than on the first login."""
+        futures = [self._pool().submit(int) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result(timeout=self.timeout)
+
+    def needs_rehash(self, password_hash):
+        # werkzeug hashes look like '<method>$<salt>$<hash>', with any
+        # parameters the configured method leaves out filled in, so compare
+        # against the prefix of a hash it actually made
+        if self._method_prefix is None:
+            self._method_prefix = self.hash('').split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._method_prefix
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
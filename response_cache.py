@@ -0,0 +1,167 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from pymongo import ReturnDocument
+
+CachedResponse = namedtuple('CachedResponse', ['etag', 'content_type', 'body'])
+
+VERSION_COUNTER = 'photos_version'
+
+
+class InProcessBackend:
+    """Byte-bounded LRU in this worker's memory; entries also expire after
+    ttl. Each worker keeps its own entries and, unless the cache is given
+    shared counters, its own version counter."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.size -= len(value)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+
+class RedisBackend:
+    """Shared backend for multi-worker deployments. Size is bounded by the
+    Redis server's maxmemory/eviction policy; entries also expire after ttl."""
+
+    def __init__(self, url, ttl=3600, prefix='photogallery:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def incr(self, name):
+        return self.client.incr(self.prefix + name)
+
+    def counter(self, name):
+        return int(self.client.get(self.prefix + name) or 0)
+
+
+class MongoCounters:
+    """Version counters in a MongoDB collection, shared by every worker.
+    Pairs with InProcessBackend so a change made through one worker
+    invalidates the pages cached by all of them.
+
+    Reads are remembered for ttl seconds, so a repeat view doesn't cost a
+    round trip; other workers see a bump at most ttl seconds late, and the
+    worker that made it sees it at once.
+    """
+
+    def __init__(self, collection, ttl=1.0):
+        self.collection = collection
+        self.ttl = ttl
+        self._values = {}   # name -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def _remember(self, name, value):
+        with self._lock:
+            # Counters only go up; don't let a read that raced an incr()
+            # put back the older value
+            _, previous = self._values.get(name, (0, None))
+            if previous is not None:
+                value = max(value, previous)
+            self._values[name] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def incr(self, name):
+        counter = self.collection.find_one_and_update(
+            {'_id': name},
+            {'$inc': {'value': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return self._remember(name, counter['value'])
+
+    def counter(self, name):
+        with self._lock:
+            expires_at, value = self._values.get(name, (0, None))
+        if time.monotonic() < expires_at:
+            return value
+        counter = self.collection.find_one({'_id': name})
+        return self._remember(name, counter['value'] if counter else 0)
+
+
+class ResponseCache:
+    """Caches rendered responses under the current photo collection version.
+
+    upload() and delete() call bump(), which moves every later lookup to a
+    new key space; entries for old versions are never read again and age
+    out of the backend. The version lives in counters, the backend itself
+    unless given somewhere shared.
+    """
+
+    def __init__(self, backend, counters=None):
+        self.backend = backend
+        self.counters = counters or backend
+        self.hits = 0
+        self.misses = 0
+
+    def version(self):
+        return self.counters.counter(VERSION_COUNTER)
+
+    def bump(self):
+        return self.counters.incr(VERSION_COUNTER)
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode()).hexdigest()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        etag, content_type, body = value.split(b'\n', 2)
+        return CachedResponse(etag.decode(), content_type.decode(), body)
+
+    def put(self, key, body, content_type):
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        self.backend.set(key, b'\n'.join((etag.encode(), content_type.encode(), body)))
+        return CachedResponse(etag, content_type, body)
@@ -0,0 +1,154 @@
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Field weights: a hit in the description counts more than one in the filename
+# or the uploader's name
+FIELD_WEIGHTS = {'description': 1.0, 'filename': 0.6, 'username': 0.4}
+
+# Prefix hits rank below exact term hits
+PREFIX_WEIGHT = 0.5
+
+# Upper bound on vocabulary terms a single query prefix may expand to
+MAX_PREFIX_TERMS = 1000
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+class SearchIndex:
+    """In-process inverted index over photo description, filename and uploader.
+
+    Every query token must match (exactly or as a prefix) for a photo to be
+    returned; results are ranked by a tf-idf style score, newest first on ties.
+    """
+
+    def __init__(self):
+        self._postings = {}    # term -> {doc_id: weight}
+        self._doc_terms = {}   # doc_id -> set of terms
+        self._terms = []       # sorted vocabulary, for prefix lookups
+        self._lock = threading.RLock()
+        self._changes = None   # add/remove calls made while a rebuild runs
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    @staticmethod
+    def _weights(description, filename, username):
+        weights = {}
+        for field, text in (('description', description), ('filename', filename), ('username', username)):
+            for term in tokenize(text):
+                weights[term] = weights.get(term, 0.0) + FIELD_WEIGHTS[field]
+        return weights
+
+    def _add_locked(self, doc_id, weights):
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                insort(self._terms, term)
+            postings[doc_id] = weight
+        self._doc_terms[doc_id] = set(weights)
+
+    def _remove_locked(self, doc_id):
+        for term in self._doc_terms.pop(doc_id, ()):
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect_left(self._terms, term)]
+
+    def add(self, doc_id, description='', filename='', username=''):
+        weights = self._weights(description, filename, username)
+        with self._lock:
+            self._remove_locked(doc_id)
+            self._add_locked(doc_id, weights)
+            if self._changes is not None:
+                self._changes.append((doc_id, weights))
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove_locked(doc_id)
+            if self._changes is not None:
+                self._changes.append((doc_id, None))
+
+    def rebuild(self, docs):
+        """Replace the index contents with docs, an iterable of
+        (doc_id, description, filename, username) tuples.
+
+        The new index is built off to the side so searches keep working
+        against the old one until it is swapped in. add() and remove() calls
+        made in the meantime are replayed onto it before the swap, since docs
+        may have been read before they happened.
+        """
+        with self._lock:
+            self._changes = []
+        fresh = SearchIndex()
+        try:
+            for doc_id, description, filename, username in docs:
+                fresh._remove_locked(doc_id)
+                fresh._add_locked(doc_id, self._weights(description, filename, username))
+        except BaseException:
+            with self._lock:
+                self._changes = None
+            raise
+        with self._lock:
+            for doc_id, weights in self._changes:
+                fresh._remove_locked(doc_id)
+                if weights is not None:
+                    fresh._add_locked(doc_id, weights)
+            self._changes = None
+            self._postings = fresh._postings
+            self._doc_terms = fresh._doc_terms
+            self._terms = fresh._terms
+            self.built_at = time.monotonic()
+
+    def _expand(self, token):
+        # Exact term first, then every other vocabulary term starting with token
+        matches = []
+        if token in self._postings:
+            matches.append((token, 1.0))
+        start = bisect_left(self._terms, token)
+        for term in self._terms[start:start + MAX_PREFIX_TERMS]:
+            if not term.startswith(token):
+                break
+            if term != token:
+                matches.append((term, PREFIX_WEIGHT))
+        return matches
+
+    def search(self, query):
+        """Return the matching doc ids for query, best match first."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        with self._lock:
+            total_docs = len(self._doc_terms) or 1
+            scores = None
+            for token in dict.fromkeys(tokens):
+                token_scores = {}
+                for term, match_weight in self._expand(token):
+                    postings = self._postings[term]
+                    idf = math.log(1 + total_docs / len(postings))
+                    for doc_id, weight in postings.items():
+                        score = match_weight * weight * idf
+                        if score > token_scores.get(doc_id, 0.0):
+                            token_scores[doc_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_id: score + token_scores[doc_id]
+                              for doc_id, score in scores.items() if doc_id in token_scores}
+                if not scores:
+                    return []
+
+        # ObjectIds sort by creation time, so ties go to the newest photo
+        ranked = sorted(scores.items(), key=lambda item: str(item[0]), reverse=True)
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return [doc_id for doc_id, _ in ranked]
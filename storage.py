@@ -0,0 +1,152 @@
+import hashlib
+import tempfile
+import time
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import metrics
+
+# How often to check whether an object being deleted is gone
+TOMBSTONE_POLL = 0.05
+
+
+class ContentStore:
+    """Content-addressed photo storage.
+
+    Objects are stored in S3 under the SHA-256 of their bytes, and the
+    objects collection keeps one document per digest with the S3 key and a
+    count of the photos that reference it. Identical uploads share a single
+    object, which is only removed from S3 once its last photo is deleted.
+
+    While the last reference's object is being removed from S3 its document
+    stays behind marked 'deleting'. New uploads of the same bytes wait for
+    it to go before storing the object again, so the delete can't remove
+    their copy. A tombstone left by a crashed worker is finished off by the
+    next upload that waits on it for longer than tombstone_timeout.
+    """
+
+    def __init__(self, s3_client, bucket, objects, prefix='objects/', derivative_prefix='derivatives/',
+                 tombstone_timeout=30):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.objects = objects
+        self.prefix = prefix
+        self.derivative_prefix = derivative_prefix
+        self.tombstone_timeout = tombstone_timeout
+
+    @staticmethod
+    def spool(stream, directory=None, chunk_size=1024 * 1024):
+        """Copy stream to a temp file, hashing it on the way.
+
+        Returns (path, sha256 hex digest, size); the caller removes the file.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as spool:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                digest.update(chunk)
+                spool.write(chunk)
+                size += len(chunk)
+        return spool.name, digest.hexdigest(), size
+
+    def key_for(self, digest, extension):
+        return f'{self.prefix}{digest[:2]}/{digest}.{extension.lower()}'
+
+    def acquire(self, digest):
+        """Take a reference on an existing object. Returns its key, or None
+        if the content has not been stored yet."""
+        while True:
+            existing = self.objects.find_one_and_update(
+                {'_id': digest, 'deleting': {'$ne': True}},
+                {'$inc': {'refcount': 1}},
+                projection={'key': 1},
+                return_document=ReturnDocument.AFTER
+            )
+            if existing:
+                return existing['key']
+            if not self._wait_for_delete(digest):
+                return None
+
+    def register(self, digest, key, size, content_type):
+        """Record a newly stored object, holding one reference to it.
+
+        Two concurrent uploads of the same new content both PUT the same
+        bytes to the same key and both count here, so neither reference is
+        lost. Returns False, holding no reference, if the object was being
+        deleted meanwhile; the delete may have removed the bytes just PUT,
+        so the caller must store them again.
+        """
+        try:
+            self.objects.update_one(
+                {'_id': digest, 'deleting': {'$ne': True}},
+                {
+                    '$setOnInsert': {'key': key, 'size': size, 'content_type': content_type},
+                    '$inc': {'refcount': 1},
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The upsert collided with a tombstone
+            self._wait_for_delete(digest)
+            return False
+        return True
+
+    def store(self, path, digest, key, size, content_type, attempts=3):
+        """PUT a spooled file under key and register it."""
+        for _ in range(attempts):
+            with metrics.timed('s3', 'upload_file'):
+                self.s3_client.upload_file(path, self.bucket, key, ExtraArgs={'ContentType': content_type})
+            if self.register(digest, key, size, content_type):
+                return
+        raise RuntimeError(f'{key} is still being deleted after {attempts} attempts to store it')
+
+    def _wait_for_delete(self, digest):
+        """Block while digest's object is being deleted. Returns True if
+        there was a tombstone to wait for."""
+        waited = False
+        deadline = time.monotonic() + self.tombstone_timeout
+        while True:
+            tombstone = self.objects.find_one({'_id': digest, 'deleting': True}, {'key': 1})
+            if tombstone is None:
+                return waited
+            waited = True
+            if time.monotonic() >= deadline:
+                # Whoever started the delete has gone away; finish it here
+                self._finish_delete(digest, tombstone['key'])
+                return True
+            time.sleep(TOMBSTONE_POLL)
+
+    def release(self, digest):
+        """Drop a reference; deletes the object and its derivatives from S3
+        when it was the last one. Returns True if the object was deleted."""
+        remaining = self.objects.find_one_and_update(
+            {'_id': digest},
+            {'$inc': {'refcount': -1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if remaining is None or remaining['refcount'] > 0:
+            return False
+        # Only tombstone the record if nobody re-acquired it in the meantime.
+        # It stays until the S3 delete is done so new uploads wait for it.
+        tombstoned = self.objects.update_one(
+            {'_id': digest, 'refcount': {'$lte': 0}, 'deleting': {'$ne': True}},
+            {'$set': {'deleting': True}}
+        )
+        if not tombstoned.modified_count:
+            return False
+        self._finish_delete(digest, remaining['key'])
+        return True
+
+    def _finish_delete(self, digest, key):
+        self.delete_object(key)
+        self.objects.delete_one({'_id': digest, 'deleting': True})
+
+    def delete_object(self, key):
+        """Delete key and every derivative generated from it."""
+        self.s3_client.delete_object(Bucket=self.bucket, Key=key)
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f'{self.derivative_prefix}{key}/'):
+            keys = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if keys:
+                self.s3_client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys})
@@ -0,0 +1,18 @@
+from metrics import Registry
+
+
+def test_counters_and_gauges_render_with_their_types():
+    registry = Registry()
+    registry.register_counter('app_jobs_total', 'Jobs by outcome', lambda: {(('outcome', 'ok'),): 3})
+    registry.register_gauge('app_in_flight', 'Calls in progress', lambda: 2)
+
+    lines = registry.render().splitlines()
+
+    assert lines == [
+        '# HELP app_jobs_total Jobs by outcome',
+        '# TYPE app_jobs_total counter',
+        'app_jobs_total{outcome="ok"} 3',
+        '# HELP app_in_flight Calls in progress',
+        '# TYPE app_in_flight gauge',
+        'app_in_flight 2',
+    ]
@@ -0,0 +1,120 @@
+import json
+import os
+
+import boto3
+import mongomock
+import pytest
+from moto import mock_aws
+
+import migrate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERS_CSV = os.path.join(ROOT, 'users.csv')
+PHOTOS_CSV = os.path.join(ROOT, 'imageRef.csv')
+
+
+class FailingWriter:
+    """Wraps a writer and fails the batch that starts at fail_at."""
+
+    def __init__(self, writer, fail_at):
+        self.writer = writer
+        self.fail_at = fail_at
+        self.written = 0
+
+    def write(self, rows):
+        if self.written == self.fail_at:
+            raise RuntimeError('simulated outage')
+        self.written += len(rows)
+        return self.writer.write(rows)
+
+
+def photo_rows():
+    return [migrate.normalize('photos', row) for row in migrate.iter_csv(PHOTOS_CSV)]
+
+
+@pytest.fixture
+def aws_env(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_REGION_NAME', 'us-east-2')
+    with mock_aws():
+        yield
+
+
+def test_mongo_users_skips_duplicate_usernames(tmp_path, monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mongomock, 'MongoClient', lambda: client)
+    checkpoint = tmp_path / 'users.json'
+    assert migrate.main(['users', USERS_CSV, '--mongo-uri', 'mongomock://', '--mongo-db', 'test_users',
+                         '--checkpoint', str(checkpoint)]) == 0
+
+    usernames = [user['username'] for user in client['test_users']['users'].find()]
+    assert len(usernames) == 7
+    assert len(set(usernames)) == len(usernames)
+    assert not checkpoint.exists()
+
+
+def test_mongo_target_requires_database_name(monkeypatch):
+    monkeypatch.setattr(migrate.Config, 'MONGO_DB_NAME', None)
+    with pytest.raises(SystemExit) as exit_info:
+        migrate.main(['users', USERS_CSV, '--mongo-uri', 'mongomock://'])
+    assert exit_info.value.code == 2
+
+
+def test_dynamodb_defaults_to_app_tables(aws_env, tmp_path, monkeypatch):
+    monkeypatch.setattr(migrate.Config, 'DYNAMODB_USERS_TABLE', 'AppUsers')
+    client = migrate.open_dynamodb(None)
+    client.create_table(
+        TableName='AppUsers',
+        KeySchema=[{'AttributeName': 'user_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'user_id', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+    assert migrate.main(['users', USERS_CSV, '--target', 'dynamodb',
+                         '--checkpoint', str(tmp_path / 'users.json')]) == 0
+    assert client.scan(TableName='AppUsers')['Count'] > 0
+
+
+def test_mongo_photos_resume_from_checkpoint(tmp_path):
+    rows = photo_rows()
+    collection = mongomock.MongoClient()['test_resume']['imageReferences']
+    path = str(tmp_path / 'photos.json')
+
+    writer = FailingWriter(migrate.MongoWriter(collection, 'photos', bulk=False), fail_at=10)
+    with pytest.raises(migrate.MigrationError):
+        migrate.migrate(iter(rows), writer, migrate.Checkpoint(path, PHOTOS_CSV), batch_size=5, workers=1)
+    with open(path) as f:
+        assert json.load(f)['rows_done'] == 10
+
+    stats = migrate.migrate(iter(rows), migrate.MongoWriter(collection, 'photos', bulk=False),
+                            migrate.Checkpoint(path, PHOTOS_CSV), batch_size=5, workers=2)
+    assert stats['resumed_from'] == 10
+    assert stats['written'] == len(rows) - 10
+    assert sorted(photo['legacy_id'] for photo in collection.find()) == sorted(row['id'] for row in rows)
+    assert not os.path.exists(path)
+
+
+def test_checkpoint_ignored_for_other_source(tmp_path):
+    path = tmp_path / 'photos.json'
+    path.write_text(json.dumps({'source': 'other.csv', 'rows_done': 10}))
+    assert migrate.Checkpoint(str(path), PHOTOS_CSV).rows_done == 0
+
+
+def test_dynamodb_photos_resume_from_checkpoint(tmp_path, aws_env):
+    client = boto3.client('dynamodb', region_name='us-east-2')
+    client.create_table(
+        TableName='ImageReferences',
+        KeySchema=[{'AttributeName': 'image_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'image_id', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    checkpoint = tmp_path / 'photos.json'
+    checkpoint.write_text(json.dumps({'source': PHOTOS_CSV, 'rows_done': 10}))
+
+    assert migrate.main(['photos', PHOTOS_CSV, '--target', 'dynamodb', '--table', 'ImageReferences',
+                         '--batch-size', '4', '--checkpoint', str(checkpoint)]) == 0
+
+    items = client.scan(TableName='ImageReferences')['Items']
+    assert sorted(item['image_id']['S'] for item in items) == sorted(row['id'] for row in photo_rows()[10:])
+    assert not checkpoint.exists()
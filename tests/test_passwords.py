@@ -0,0 +1,31 @@
+import os
+import signal
+
+import pytest
+
+from passwords import PasswordHasher, PoolSaturated
+
+METHOD = 'pbkdf2:sha256:1000'
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(method=METHOD, max_workers=1)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_killed_child_is_replaced(hasher):
+    hasher.warm_up()
+    for pid in list(hasher._pool()._processes):
+        os.kill(pid, signal.SIGKILL)
+
+    password_hash = hasher.hash('secret')
+    assert hasher.verify(password_hash, 'secret')
+
+
+def test_child_dying_mid_call_raises_saturated_then_recovers(hasher):
+    with pytest.raises(PoolSaturated):
+        hasher._call(os._exit, 1)
+
+    assert hasher.verify(hasher.hash('secret'), 'secret')
@@ -0,0 +1,23 @@
+import mongomock
+
+import response_cache
+from response_cache import InProcessBackend, MongoCounters, ResponseCache
+
+
+def test_shared_version_is_reread_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(response_cache.time, 'monotonic', lambda: now[0])
+    collection = mongomock.MongoClient()['test_cache'].cacheCounters
+    other_worker = MongoCounters(collection, ttl=1.0)
+    cache = ResponseCache(InProcessBackend(), counters=MongoCounters(collection, ttl=1.0))
+
+    assert cache.version() == 0
+    other_worker.incr('photos_version')
+    # Within the ttl the remembered version is used without a read
+    assert cache.version() == 0
+    now[0] += 1.5
+    assert cache.version() == 1
+
+    # A bump made through this worker is visible at once
+    assert cache.bump() == 2
+    assert cache.version() == 2
@@ -0,0 +1,55 @@
+from search_index import SearchIndex
+
+
+def test_all_tokens_must_match_and_prefixes_rank_lower():
+    index = SearchIndex()
+    index.add(1, 'red brand car', 'car.jpg', 'alice')
+    index.add(2, 'brandy glass', 'glass.jpg', 'bob')
+    index.add(3, 'red apple', 'apple.jpg', 'alice')
+
+    assert index.search('red car') == [1]
+    assert index.search('brand') == [1, 2]
+    assert index.search('alice') == [3, 1]
+    assert index.search('') == []
+
+
+def test_add_replaces_and_remove_drops_terms():
+    index = SearchIndex()
+    index.add(1, 'sunset beach')
+    index.add(1, 'mountain lake')
+    assert index.search('sunset') == []
+    assert index.search('lake') == [1]
+
+    index.remove(1)
+    assert index.search('lake') == []
+    assert len(index) == 0
+    assert index._terms == []
+
+
+def test_rebuild_replaces_contents():
+    index = SearchIndex()
+    index.add(1, 'stale')
+    index.rebuild([(2, 'fresh photo', 'a.jpg', 'carol')])
+
+    assert index.search('stale') == []
+    assert index.search('fresh') == [2]
+    assert index.built_at is not None
+
+
+def test_changes_during_rebuild_survive_the_swap():
+    index = SearchIndex()
+    index.add(1, 'old brand')
+    index.add(2, 'going away')
+
+    def docs():
+        yield (1, 'old brand', '', '')
+        # An upload and a delete land while the rebuild is reading
+        index.add(3, 'new brand')
+        index.remove(2)
+        yield (2, 'going away', '', '')
+
+    index.rebuild(docs())
+
+    assert index.search('brand') == [3, 1]
+    assert index.search('away') == []
+    assert index._changes is None
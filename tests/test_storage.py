@@ -0,0 +1,109 @@
+import io
+import os
+import threading
+import time
+
+import boto3
+import mongomock
+import pytest
+from moto import mock_aws
+
+from storage import ContentStore
+
+BUCKET = 'test-photos'
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def store(s3):
+    return ContentStore(s3, BUCKET, mongomock.MongoClient()['test_storage'].storedObjects, tombstone_timeout=0.5)
+
+
+def keys(s3):
+    return sorted(item['Key'] for item in s3.list_objects_v2(Bucket=BUCKET).get('Contents', []))
+
+
+def stored(store, s3, body=b'photo'):
+    """Store body the way an upload does and return (digest, key)."""
+    path, digest, size = store.spool(io.BytesIO(body))
+    key = store.acquire(digest)
+    if key is None:
+        key = store.key_for(digest, 'jpg')
+        store.store(path, digest, key, size, 'image/jpeg')
+    os.remove(path)
+    return digest, key
+
+
+def tombstone(store, s3, body=b'photo'):
+    digest, key = stored(store, s3, body)
+    store.objects.update_one({'_id': digest}, {'$set': {'refcount': 0, 'deleting': True}})
+    return digest, key
+
+
+def test_duplicate_upload_skips_put_and_counts_reference(store, s3):
+    puts = []
+    s3.meta.events.register('before-call.s3.PutObject', lambda **kwargs: puts.append(kwargs))
+
+    first = stored(store, s3)
+    second = stored(store, s3)
+
+    assert first == second
+    assert len(puts) == 1
+    assert store.objects.find_one({'_id': first[0]})['refcount'] == 2
+
+
+def test_last_release_deletes_object_and_derivatives(store, s3):
+    digest, key = stored(store, s3)
+    stored(store, s3)
+    s3.put_object(Bucket=BUCKET, Key=f'derivatives/{key}/w320.jpg', Body=b'thumb')
+    s3.put_object(Bucket=BUCKET, Key='derivatives/other/w320.jpg', Body=b'thumb')
+
+    assert not store.release(digest)
+    assert key in keys(s3)
+
+    assert store.release(digest)
+    assert keys(s3) == ['derivatives/other/w320.jpg']
+    assert store.objects.find_one({'_id': digest}) is None
+
+
+def test_acquire_waits_for_delete_in_progress(store, s3):
+    store.tombstone_timeout = 10
+    digest, key = tombstone(store, s3)
+    # The deleting worker finishes shortly
+    finisher = threading.Timer(0.2, store._finish_delete, (digest, key))
+    finisher.start()
+
+    start = time.monotonic()
+    assert store.acquire(digest) is None
+    assert time.monotonic() - start >= 0.2
+    finisher.join()
+    assert store.objects.find_one({'_id': digest}) is None
+
+
+def test_acquire_finishes_abandoned_delete(store, s3):
+    digest, key = tombstone(store, s3)
+
+    start = time.monotonic()
+    assert store.acquire(digest) is None
+    assert time.monotonic() - start >= store.tombstone_timeout
+    assert key not in keys(s3)
+    assert store.objects.find_one({'_id': digest}) is None
+
+
+def test_register_against_tombstone_holds_no_reference(store, s3):
+    digest, key = tombstone(store, s3)
+
+    assert not store.register(digest, key, 5, 'image/jpeg')
+    assert store.objects.find_one({'_id': digest}) is None
+
+    assert store.register(digest, key, 5, 'image/jpeg')
+    assert store.objects.find_one({'_id': digest})['refcount'] == 1
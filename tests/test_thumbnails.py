@@ -0,0 +1,53 @@
+import io
+
+import boto3
+import mongomock
+import pytest
+from moto import mock_aws
+from PIL import Image
+
+from thumbnails import ThumbnailPipeline
+
+BUCKET = 'test-photos'
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET)
+        photos = mongomock.MongoClient()['test_thumbnails'].imageReferences
+        pipeline = ThumbnailPipeline(s3, photos, BUCKET, widths=(16,), max_pending=2)
+        yield pipeline
+        pipeline.shutdown()
+
+
+def put_image(s3, key):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (200, 20, 20)).save(buffer, 'JPEG')
+    s3.put_object(Bucket=BUCKET, Key=key, Body=buffer.getvalue())
+
+
+def test_backfill_generates_once_per_stored_object(pipeline):
+    s3 = pipeline.s3_client
+    put_image(s3, 'objects/ab/shared.jpg')
+    put_image(s3, 'legacy.jpg')
+    put_image(s3, 'objects/cd/single.jpg')
+    pipeline.photos.insert_many(
+        [{'filename': f'meme{i}.jpg', 'key': 'objects/ab/shared.jpg'} for i in range(5)]
+        + [{'filename': 'legacy.jpg'}, {'filename': 'legacy.jpg'}]
+        + [{'filename': 'single.jpg', 'key': 'objects/cd/single.jpg',
+            'derivatives': {'thumbnails': []}}]
+    )
+    gets = []
+    s3.meta.events.register('before-parameter-build.s3.GetObject', lambda params, **kwargs: gets.append(params['Key']))
+
+    assert pipeline.backfill() == 7
+
+    assert sorted(gets) == ['legacy.jpg', 'objects/ab/shared.jpg']
+    assert pipeline.photos.count_documents({'derivatives': {'$exists': False}}) == 0
+    shared = pipeline.photos.find_one({'filename': 'meme3.jpg'})['derivatives']
+    assert shared['thumbnails'] == [{'width': 16, 'key': 'derivatives/objects/ab/shared.jpg/w16.jpg'}]
+    assert pipeline.photos.find_one({'filename': 'single.jpg'})['derivatives'] == {'thumbnails': []}
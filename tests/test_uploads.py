@@ -0,0 +1,114 @@
+import datetime
+import hashlib
+import io
+import threading
+
+import boto3
+import mongomock
+import pytest
+from moto import mock_aws
+
+from storage import ContentStore
+from uploads import BatchUploader
+
+BUCKET = 'test-photos'
+
+
+@pytest.fixture
+def env(monkeypatch, tmp_path):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET)
+        db = mongomock.MongoClient()['test_uploads']
+        store = ContentStore(s3, BUCKET, db.storedObjects)
+        uploader = BatchUploader(s3, BUCKET, db.imageReferences, db.uploadBatches, store, stale_after=60)
+        yield uploader, db, s3, tmp_path
+        uploader.shutdown()
+
+
+def spooled(store, tmp_path, body, name='photo.jpg'):
+    path, digest, size = store.spool(io.BytesIO(body), str(tmp_path))
+    return {'path': path, 'sha256': digest, 'size': size, 'key': store.key_for(digest, 'jpg'),
+            'filename': name, 'description': '', 'content_type': 'image/jpeg'}
+
+
+def age(db, batch_id, seconds):
+    db.uploadBatches.update_one({'_id': batch_id}, {'$set': {
+        'updated_at': datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=seconds)
+    }})
+
+
+def test_batch_uploads_and_records_photos(env):
+    uploader, db, s3, tmp_path = env
+    files = [spooled(uploader.store, tmp_path, b'one'), spooled(uploader.store, tmp_path, b'two')]
+    batch_id = uploader.submit('user-1', files)
+    uploader.shutdown()
+
+    batch = uploader.status(batch_id, 'user-1')
+    assert batch['state'] == 'complete'
+    assert 'sha256' not in batch['files'][0] and 'user_id' not in batch
+    assert db.imageReferences.count_documents({'user_id': 'user-1'}) == 2
+    assert db.storedObjects.find_one({'_id': files[0]['sha256']})['refcount'] == 1
+
+
+def test_stale_batch_is_failed_and_releases_references(env):
+    uploader, db, s3, tmp_path = env
+    digest = hashlib.sha256(b'shared').hexdigest()
+    key = uploader.store.key_for(digest, 'jpg')
+    s3.put_object(Bucket=BUCKET, Key=key, Body=b'shared')
+    uploader.store.register(digest, key, 6, 'image/jpeg')
+    pending = spooled(uploader.store, tmp_path, b'never sent')
+
+    # A worker that died after spooling one file and deduplicating another
+    uploader.store.acquire(digest)
+    db.uploadBatches.insert_one({
+        '_id': 'dead', 'user_id': 'user-1', 'state': 'uploading',
+        'created_at': datetime.datetime.now(datetime.timezone.utc),
+        'files': [{'filename': 'a.jpg', 'sha256': digest, 'path': None, 'state': 'deduplicated'},
+                  {'filename': 'b.jpg', 'sha256': pending['sha256'], 'path': pending['path'], 'state': 'pending'}],
+    })
+    age(db, 'dead', 30)
+    assert uploader.status('dead', 'user-1')['state'] == 'uploading'
+
+    age(db, 'dead', 120)
+    batch = uploader.status('dead', 'user-1')
+    assert batch['state'] == 'failed'
+    assert [upload['state'] for upload in batch['files']] == ['failed', 'failed']
+    assert db.storedObjects.find_one({'_id': digest})['refcount'] == 1
+    assert not list(tmp_path.iterdir())
+    assert uploader.sweep() == 0
+
+
+def test_sweep_expires_only_stale_batches(env):
+    uploader, db, s3, tmp_path = env
+    for batch_id, seconds in (('old', 600), ('live', 5)):
+        db.uploadBatches.insert_one({'_id': batch_id, 'user_id': 'user-1', 'state': 'uploading', 'files': []})
+        age(db, batch_id, seconds)
+
+    assert uploader.sweep() == 1
+    assert db.uploadBatches.find_one({'_id': 'old'})['state'] == 'failed'
+    assert db.uploadBatches.find_one({'_id': 'live'})['state'] == 'uploading'
+
+
+def test_upload_finishing_after_expiry_drops_its_reference(env):
+    uploader, db, s3, tmp_path = env
+    upload = spooled(uploader.store, tmp_path, b'slow')
+    expired = threading.Event()
+    register = uploader.store.register
+
+    def register_after_expiry(*args):
+        expired.wait(5)
+        return register(*args)
+    uploader.store.register = register_after_expiry
+
+    batch_id = uploader.submit('user-1', [upload])
+    age(db, batch_id, 120)
+    assert uploader.expire(batch_id)
+    expired.set()
+    uploader.shutdown()
+
+    assert db.uploadBatches.find_one({'_id': batch_id})['state'] == 'failed'
+    assert db.imageReferences.count_documents({}) == 0
+    assert db.storedObjects.find_one({'_id': upload['sha256']}) is None
@@ -0,0 +1,199 @@
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class JobStats:
+    """Counters and timings for derivative jobs."""
+
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self):
+        with self._lock:
+            jobs = self.completed + self.failed
+            return {
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'total_seconds': self.total_seconds,
+                'max_seconds': self.max_seconds,
+                'mean_seconds': self.total_seconds / jobs if jobs else 0.0,
+            }
+
+
+class ThumbnailPipeline:
+    """Builds resized JPEG thumbnails (and a first-frame still for animated
+    GIFs) on a bounded background pool and records them on the photo document
+    under 'derivatives'.
+
+    At most max_pending jobs are queued or running. enqueue() drops anything
+    beyond that, and the backfill command picks those photos up later.
+    """
+
+    def __init__(self, s3_client, photos, bucket, widths=(320, 640, 1024), prefix='derivatives/',
+                 max_workers=2, max_pending=100, quality=82, on_complete=None):
+        self.s3_client = s3_client
+        self.on_complete = on_complete
+        self.photos = photos
+        self.bucket = bucket
+        self.widths = sorted(widths)
+        self.prefix = prefix
+        self.quality = quality
+        self.stats = JobStats()
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Worker threads don't survive a fork, so each process gets its own pool
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='thumbnails')
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+                self._pid = os.getpid()
+            return self._executor
+
+    def enqueue(self, photo_id, key, block=False):
+        return self._submit(key, {'_id': photo_id}, photo_id, block)
+
+    def _submit(self, key, query, photo_id=None, block=False):
+        executor = self._pool()
+        slots = self._slots
+        if not slots.acquire(blocking=block):
+            self.stats.reject()
+            logger.warning('Thumbnail queue full, skipping %s', key)
+            return None
+        future = executor.submit(self._run, key, query, photo_id)
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def backfill(self, limit=0):
+        """Generate derivatives for every photo that has none and wait for
+        them to finish. Photos sharing a stored object get one job between
+        them, and limit caps the number of jobs. Returns the number of
+        photos processed."""
+        pipeline = [
+            {'$match': {'derivatives': {'$exists': False}}},
+            # Photos from before content addressing are stored under their filename
+            {'$group': {'_id': {'$ifNull': ['$key', '$filename']}, 'photos': {'$sum': 1}}},
+        ]
+        if limit:
+            pipeline.append({'$limit': limit})
+
+        processed = 0
+        in_flight = {}
+
+        def drain(return_when):
+            nonlocal processed
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                photos = in_flight.pop(future)
+                if future.result() is not None:
+                    processed += photos
+
+        for group in self.photos.aggregate(pipeline, allowDiskUse=True):
+            key = group['_id']
+            query = {
+                '$or': [{'key': key}, {'key': {'$exists': False}, 'filename': key}],
+                'derivatives': {'$exists': False},
+            }
+            in_flight[self._submit(key, query, block=True)] = group['photos']
+            if len(in_flight) >= self.max_pending:
+                drain(FIRST_COMPLETED)
+        if in_flight:
+            drain(ALL_COMPLETED)
+        return processed
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs; with wait, block until the queued ones finish."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+                self._pid = None
+
+    def _run(self, key, query, photo_id):
+        start = time.perf_counter()
+        try:
+            derivatives = self.generate(key)
+            self.photos.update_many(query, {'$set': {'derivatives': derivatives}})
+        except Exception:
+            elapsed = time.perf_counter() - start
+            self.stats.record(elapsed, ok=False)
+            logger.exception('Thumbnail job for %s failed after %.3fs', key, elapsed)
+            return None
+        elapsed = time.perf_counter() - start
+        self.stats.record(elapsed, ok=True)
+        logger.info('Thumbnail job for %s finished in %.3fs', key, elapsed)
+        if self.on_complete:
+            self.on_complete(photo_id, derivatives)
+        return derivatives
+
+    def generate(self, key):
+        original = self.s3_client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        with Image.open(io.BytesIO(original)) as image:
+            animated = getattr(image, 'is_animated', False)
+            image.seek(0)
+            frame = self._flatten(image)
+
+        derivatives = {'thumbnails': []}
+        widths = [width for width in self.widths if width < frame.width] or [frame.width]
+        for width in widths:
+            thumbnail = frame.copy()
+            thumbnail.thumbnail((width, frame.height))
+            derivative_key = f'{self.prefix}{key}/w{width}.jpg'
+            self._put(derivative_key, thumbnail)
+            derivatives['thumbnails'].append({'width': width, 'key': derivative_key})
+
+        if animated:
+            still_key = f'{self.prefix}{key}/still.jpg'
+            self._put(still_key, frame)
+            derivatives['still'] = still_key
+        return derivatives
+
+    @staticmethod
+    def _flatten(image):
+        # JPEG has no alpha channel, so composite transparent images onto white
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+
+    def _put(self, key, image):
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=self.quality, optimize=True)
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=buffer.getvalue(),
+            ContentType='image/jpeg',
+            CacheControl='public, max-age=31536000, immutable'
+        )
@@ -0,0 +1,265 @@
+import datetime
+import logging
+import os
+import threading
+import uuid
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from s3transfer.manager import TransferConfig, TransferManager
+from s3transfer.subscribers import BaseSubscriber
+
+logger = logging.getLogger(__name__)
+
+# Fields of a batch's file entries that only the uploader needs
+PRIVATE_FIELDS = {'user_id': 0, 'files.sha256': 0, 'files.path': 0}
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class _FileDone(BaseSubscriber):
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def on_done(self, future, **kwargs):
+        self.batch.file_done(self.index, future)
+
+
+class _Batch:
+    def __init__(self, uploader, batch_id, user_id, files):
+        self.uploader = uploader
+        self.batch_id = batch_id
+        self.user_id = user_id
+        self.files = files
+        self.remaining = sum(1 for upload in files if not upload.get('existing'))
+        # Duplicates of already stored content need no transfer
+        self.succeeded = [upload for upload in files if upload.get('existing')]
+        self._lock = threading.Lock()
+
+    def file_done(self, index, future):
+        upload = self.files[index]
+        try:
+            future.result()
+            store = self.uploader.store
+            if not store.register(upload['sha256'], upload['key'], upload['size'], upload['content_type']):
+                # A delete of the same content raced this transfer; store it again
+                store.store(upload['path'], upload['sha256'], upload['key'], upload['size'],
+                            upload['content_type'])
+            state = 'uploaded'
+        except Exception:
+            logger.exception('Batch %s: upload of %s failed', self.batch_id, upload['key'])
+            state = 'failed'
+        finally:
+            os.remove(upload['path'])
+
+        recorded = self.uploader.batches.update_one(
+            {'_id': self.batch_id, 'state': 'uploading'},
+            {'$set': {f'files.{index}.state': state, 'updated_at': _now()}}
+        )
+        if not recorded.matched_count:
+            # expire() gave up on the batch while this file was in flight and
+            # released the references it could see; this one is ours to drop
+            if state == 'uploaded':
+                self.uploader.store.release(upload['sha256'])
+            state = 'failed'
+        with self._lock:
+            if state == 'uploaded':
+                self.succeeded.append(upload)
+            self.remaining -= 1
+            finished = self.remaining == 0
+        if finished:
+            self.complete()
+
+    def complete(self):
+        try:
+            self.uploader.finish(self)
+        except Exception:
+            logger.exception('Batch %s: failed to record photos', self.batch_id)
+            self.uploader.batches.update_one({'_id': self.batch_id}, {'$set': {'state': 'failed'}})
+        finally:
+            self.uploader._active.discard(self.batch_id)
+
+
+class BatchUploader:
+    """Uploads batches of files to S3 in the background through one shared
+    s3transfer TransferManager, then records the photos with a single
+    insert_many.
+
+    Progress is stored in the batches collection, so any worker can answer a
+    status poll for a batch started on another. Each process refreshes
+    updated_at on its batches in flight every stale_after / 3 seconds; a
+    batch left 'uploading' longer than stale_after belongs to a worker that
+    died, and expire() fails it and drops the references it held.
+    """
+
+    def __init__(self, s3_client, bucket, photos, batches, store, multipart_chunksize=8 * 1024 * 1024,
+                 max_concurrency=10, stale_after=300, on_complete=None):
+        self.bucket = bucket
+        self.stale_after = stale_after
+        self.store = store
+        self.photos = photos
+        self.batches = batches
+        self.on_complete = on_complete
+        self.s3_client = s3_client
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_chunksize,
+            multipart_chunksize=multipart_chunksize,
+            max_request_concurrency=max_concurrency
+        )
+        self._manager = None
+        self._pid = None
+        self._active = set()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def _transfer_manager(self):
+        # The manager's threads don't survive a fork; build one per process
+        with self._lock:
+            if self._pid != os.getpid():
+                self._manager = TransferManager(self.s3_client, self.transfer_config)
+                self._active = set()
+                self._stopping = threading.Event()
+                threading.Thread(target=self._heartbeat, args=(self._active, self._stopping),
+                                 name='batch-heartbeat', daemon=True).start()
+                self._pid = os.getpid()
+            return self._manager
+
+    def _heartbeat(self, active, stopping):
+        while not stopping.wait(self.stale_after / 3):
+            batch_ids = list(active)
+            if not batch_ids:
+                continue
+            try:
+                self.batches.update_many({'_id': {'$in': batch_ids}, 'state': 'uploading'},
+                                         {'$set': {'updated_at': _now()}})
+            except Exception:
+                logger.exception('Failed to refresh %d upload batches', len(batch_ids))
+
+    def submit(self, user_id, files):
+        """Start uploading files and return the batch id.
+
+        files is a list of dicts with 'path' (a local spool file this class
+        takes ownership of), 'key', 'sha256', 'size', 'filename',
+        'description' and 'content_type'. Files marked 'existing' already
+        hold a reference on a stored object and are not transferred again.
+        """
+        batch_id = str(uuid.uuid4())
+        now = _now()
+        self.batches.insert_one({
+            '_id': batch_id,
+            'user_id': user_id,
+            'state': 'uploading',
+            'created_at': now,
+            'updated_at': now,
+            # sha256 and path let expire() clean up after a worker that died
+            'files': [{
+                'filename': upload['filename'],
+                'sha256': upload['sha256'],
+                'path': upload['path'],
+                'state': 'deduplicated' if upload.get('existing') else 'pending',
+            } for upload in files],
+        })
+
+        batch = _Batch(self, batch_id, user_id, files)
+        if not batch.remaining:
+            batch.complete()
+            return batch_id
+        manager = self._transfer_manager()
+        self._active.add(batch_id)
+        for index, upload in enumerate(files):
+            if upload.get('existing'):
+                continue
+            manager.upload(
+                upload['path'],
+                self.bucket,
+                upload['key'],
+                extra_args={'ContentType': upload['content_type']},
+                subscribers=[_FileDone(batch, index)]
+            )
+        return batch_id
+
+    def finish(self, batch):
+        claimed = self.batches.update_one({'_id': batch.batch_id, 'state': 'uploading'},
+                                          {'$set': {'state': 'recording', 'updated_at': _now()}})
+        if not claimed.matched_count:
+            logger.warning('Batch %s expired before it finished; its photos were not recorded', batch.batch_id)
+            return
+        documents = [{
+            'filename': upload['filename'],
+            'key': upload['key'],
+            'sha256': upload['sha256'],
+            'description': upload['description'],
+            'user_id': batch.user_id,
+        } for upload in batch.succeeded]
+        if documents:
+            try:
+                self.photos.insert_many(documents)
+            except Exception as e:
+                # Drop the references held for photos that were never recorded
+                inserted = e.details.get('nInserted', 0) if isinstance(e, BulkWriteError) else 0
+                for upload in batch.succeeded[inserted:]:
+                    self.store.release(upload['sha256'])
+                raise
+
+        if len(documents) == len(batch.files):
+            state = 'complete'
+        else:
+            state = 'partial' if documents else 'failed'
+        self.batches.update_one({'_id': batch.batch_id}, {'$set': {
+            'state': state,
+            'photo_ids': [str(document['_id']) for document in documents],
+        }})
+        if self.on_complete and documents:
+            self.on_complete(documents)
+
+    def status(self, batch_id, user_id):
+        batch = self.batches.find_one({'_id': batch_id, 'user_id': user_id}, PRIVATE_FIELDS)
+        if batch and batch['state'] == 'uploading' and self.expire(batch_id):
+            batch = self.batches.find_one({'_id': batch_id}, PRIVATE_FIELDS)
+        return batch
+
+    def expire(self, batch_id):
+        """Fail batch_id if it has been 'uploading' for longer than
+        stale_after without a heartbeat, releasing the stored-object
+        references its files hold and removing any spool files left on this
+        host. Returns True if the batch was expired."""
+        cutoff = _now() - datetime.timedelta(seconds=self.stale_after)
+        batch = self.batches.find_one_and_update(
+            {'_id': batch_id, 'state': 'uploading', 'updated_at': {'$lt': cutoff}},
+            {'$set': {'state': 'failed'}},
+            return_document=ReturnDocument.AFTER
+        )
+        if batch is None:
+            return False
+        logger.warning('Batch %s: no heartbeat since %s, marking it failed', batch_id, batch['updated_at'])
+        for upload in batch['files']:
+            if upload['state'] in ('deduplicated', 'uploaded'):
+                self.store.release(upload['sha256'])
+            if upload.get('path'):
+                try:
+                    os.remove(upload['path'])
+                except FileNotFoundError:
+                    pass
+        self.batches.update_one({'_id': batch_id}, {'$set': {
+            f'files.{index}.state': 'failed' for index in range(len(batch['files']))
+        }})
+        return True
+
+    def sweep(self):
+        """Expire every stale batch. Returns the number expired."""
+        cutoff = _now() - datetime.timedelta(seconds=self.stale_after)
+        stale = self.batches.find({'state': 'uploading', 'updated_at': {'$lt': cutoff}}, {'_id': 1})
+        return sum(self.expire(batch['_id']) for batch in stale)
+
+    def shutdown(self, wait=True):
+        """Stop the heartbeat; with wait, let transfers in flight finish and
+        their batches be recorded first."""
+        with self._lock:
+            if self._manager is not None and self._pid == os.getpid():
+                self._manager.shutdown(cancel=not wait)
+                self._stopping.set()
+                self._manager = None
+                self._pid = None
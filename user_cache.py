@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class UsernameCache:
+    """Process-wide LRU cache of user _id -> username with a TTL.
+
+    A cached value of None means the user does not exist, so photos owned by
+    deleted users don't trigger a lookup on every render.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, default=MISSING):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                username, expires = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return username
+                del self._entries[user_id]
+            self.misses += 1
+        return default
+
+    def put(self, user_id, username):
+        with self._lock:
+            self._entries[user_id] = (username, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def resolve(self, user_ids, users_collection):
+        """Return {user_id: username} for user_ids, querying only the misses.
+
+        All misses are fetched with a single $in query projected to the
+        username field.
+        """
+        resolved = {}
+        missing = set()
+        for user_id in set(user_ids):
+            username = self.get(user_id)
+            if username is MISSING:
+                missing.add(user_id)
+            else:
+                resolved[user_id] = username
+
+        if missing:
+            for user in users_collection.find({'_id': {'$in': list(missing)}}, {'username': 1}):
+                resolved[user['_id']] = user['username']
+                self.put(user['_id'], user['username'])
+                missing.discard(user['_id'])
+            for user_id in missing:
+                resolved[user_id] = None
+                self.put(user_id, None)
+        return resolved
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }